@@ -1,18 +1,30 @@
 import os
+import gc
+import re
+import asyncio
 import logging
-from typing import List, Dict, Any
+import subprocess
+import json
+import functools
+import math
+import queue
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import List, Dict, Any, Optional, Tuple, Iterator, Iterable
 import torch
-from moviepy.editor import VideoFileClip, CompositeVideoClip, ColorClip, ImageClip
-import whisper
+from faster_whisper import WhisperModel, BatchedInferencePipeline
 import srt
 from datetime import timedelta
 from PIL import Image, ImageDraw, ImageFont
 import numpy as np
 from tqdm import tqdm
+from tqdm.asyncio import tqdm_asyncio
 import tiktoken
 import textwrap
 import argparse
-from openai import OpenAI
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -23,18 +35,46 @@ class Config:
     FONT_PATH = os.getenv('FONT_PATH', "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf")
     JAPANESE_FONT_PATH = os.getenv('JAPANESE_FONT_PATH', "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc")
     TEMP_AUDIO_FILE = os.getenv('TEMP_AUDIO_FILE', "temp_audio.wav")
+    FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', "ffmpeg")
+    FFPROBE_BINARY = os.getenv('FFPROBE_BINARY', "ffprobe")
 
     # Video processing
     DEFAULT_SUBTITLE_HEIGHT = int(os.getenv('DEFAULT_SUBTITLE_HEIGHT', 200))
     DEFAULT_FONT_SIZE = int(os.getenv('DEFAULT_FONT_SIZE', 32))
     MAX_SUBTITLE_LINES = int(os.getenv('MAX_SUBTITLE_LINES', 3))
+    RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', os.cpu_count() or 1))
+    # 'libass' burns the SRT in with ffmpeg's subtitles filter, 'pillow' overlays Pillow-rendered images with ffmpeg
+    SUBTITLE_RENDERER = os.getenv('SUBTITLE_RENDERER', 'libass')
+    SUBTITLE_FONT_NAME = os.getenv('SUBTITLE_FONT_NAME', "DejaVu Sans")
+    JAPANESE_SUBTITLE_FONT_NAME = os.getenv('JAPANESE_SUBTITLE_FONT_NAME', "Noto Sans CJK JP")
+    # Pillow renderer outline: 'stroke' (rounded Pillow stroke) or 'square' (the original square offset outline)
+    SUBTITLE_OUTLINE = os.getenv('SUBTITLE_OUTLINE', 'stroke')
+    OUTLINE_WIDTH = int(os.getenv('OUTLINE_WIDTH', 2))
 
     # Video encoding
     VIDEO_CODEC = os.getenv('VIDEO_CODEC', 'libx264')
-    AUDIO_CODEC = os.getenv('AUDIO_CODEC', 'aac')
-    VIDEO_PRESET = os.getenv('VIDEO_PRESET', 'medium')
+    VIDEO_PRESET = os.getenv('VIDEO_PRESET', 'faster')
     CRF = os.getenv('CRF', '23')
     PIXEL_FORMAT = os.getenv('PIXEL_FORMAT', 'yuv420p')
+    # 'auto' uses NVENC when a CUDA GPU and an NVENC-enabled ffmpeg are available, '1' forces it, '0' disables it
+    USE_HW_ENCODER = os.getenv('USE_HW_ENCODER', 'auto').lower()
+    NVENC_CODEC = os.getenv('NVENC_CODEC', 'h264_nvenc')
+    NVENC_PRESET = os.getenv('NVENC_PRESET', 'p4')
+    # Constant-quality target for NVENC; CQ 23 on NVENC is roughly equivalent to CRF 23 on libx264
+    NVENC_CQ = os.getenv('NVENC_CQ', CRF)
+
+    # Whisper settings
+    WHISPER_BEAM_SIZE = int(os.getenv('WHISPER_BEAM_SIZE', 5))
+    WHISPER_BATCH_SIZE = os.getenv('WHISPER_BATCH_SIZE')  # derived from available VRAM when unset
+    # Silences longer than this are cut out by the Silero VAD before decoding
+    VAD_MIN_SILENCE_MS = int(os.getenv('VAD_MIN_SILENCE_MS', 500))
+    # CTranslate2 compute type, e.g. 'float16' for full FP16 on GPUs with spare VRAM; int8 variants when unset
+    WHISPER_COMPUTE_TYPE = os.getenv('WHISPER_COMPUTE_TYPE')
+
+    # Dual-GPU pipeline: transcription on the first GPU, encoding of finished windows on the second
+    PIPELINE_WINDOW_SECONDS = float(os.getenv('PIPELINE_WINDOW_SECONDS', 30))
+    PIPELINE_QUEUE_WINDOWS = int(os.getenv('PIPELINE_QUEUE_WINDOWS', 1))
+    PIPELINE_ENCODER_GPU = int(os.getenv('PIPELINE_ENCODER_GPU', 1))
 
     # Tiktoken related settings
     TIKTOKEN_MODEL = "cl100k_base"
@@ -44,11 +84,281 @@ class Config:
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     DEFAULT_GPT_MODEL = "gpt-4o"
     GPT_MAX_TOKENS = 4000
+    TRANSLATION_BATCH_SIZE = int(os.getenv('TRANSLATION_BATCH_SIZE', 20))
+    TRANSLATION_CONCURRENCY = int(os.getenv('TRANSLATION_CONCURRENCY', 20))
+    OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 5))
+
+# Whisper language names (and the aliases openai-whisper accepted) mapped to Whisper language codes
+LANGUAGE_CODES = {
+    "english": "en",
+    "chinese": "zh",
+    "german": "de",
+    "spanish": "es",
+    "russian": "ru",
+    "korean": "ko",
+    "french": "fr",
+    "japanese": "ja",
+    "portuguese": "pt",
+    "turkish": "tr",
+    "polish": "pl",
+    "catalan": "ca",
+    "dutch": "nl",
+    "arabic": "ar",
+    "swedish": "sv",
+    "italian": "it",
+    "indonesian": "id",
+    "hindi": "hi",
+    "finnish": "fi",
+    "vietnamese": "vi",
+    "hebrew": "he",
+    "ukrainian": "uk",
+    "greek": "el",
+    "malay": "ms",
+    "czech": "cs",
+    "romanian": "ro",
+    "danish": "da",
+    "hungarian": "hu",
+    "tamil": "ta",
+    "norwegian": "no",
+    "thai": "th",
+    "urdu": "ur",
+    "croatian": "hr",
+    "bulgarian": "bg",
+    "lithuanian": "lt",
+    "latin": "la",
+    "maori": "mi",
+    "malayalam": "ml",
+    "welsh": "cy",
+    "slovak": "sk",
+    "telugu": "te",
+    "persian": "fa",
+    "latvian": "lv",
+    "bengali": "bn",
+    "serbian": "sr",
+    "azerbaijani": "az",
+    "slovenian": "sl",
+    "kannada": "kn",
+    "estonian": "et",
+    "macedonian": "mk",
+    "breton": "br",
+    "basque": "eu",
+    "icelandic": "is",
+    "armenian": "hy",
+    "nepali": "ne",
+    "mongolian": "mn",
+    "bosnian": "bs",
+    "kazakh": "kk",
+    "albanian": "sq",
+    "swahili": "sw",
+    "galician": "gl",
+    "marathi": "mr",
+    "punjabi": "pa",
+    "sinhala": "si",
+    "khmer": "km",
+    "shona": "sn",
+    "yoruba": "yo",
+    "somali": "so",
+    "afrikaans": "af",
+    "occitan": "oc",
+    "georgian": "ka",
+    "belarusian": "be",
+    "tajik": "tg",
+    "sindhi": "sd",
+    "gujarati": "gu",
+    "amharic": "am",
+    "yiddish": "yi",
+    "lao": "lo",
+    "uzbek": "uz",
+    "faroese": "fo",
+    "haitian creole": "ht",
+    "pashto": "ps",
+    "turkmen": "tk",
+    "nynorsk": "nn",
+    "maltese": "mt",
+    "sanskrit": "sa",
+    "luxembourgish": "lb",
+    "myanmar": "my",
+    "tibetan": "bo",
+    "tagalog": "tl",
+    "malagasy": "mg",
+    "assamese": "as",
+    "tatar": "tt",
+    "hawaiian": "haw",
+    "lingala": "ln",
+    "hausa": "ha",
+    "bashkir": "ba",
+    "javanese": "jw",
+    "sundanese": "su",
+    "cantonese": "yue",
+    # Aliases
+    "burmese": "my",
+    "valencian": "ca",
+    "flemish": "nl",
+    "haitian": "ht",
+    "letzeburgesch": "lb",
+    "pushto": "ps",
+    "panjabi": "pa",
+    "moldavian": "ro",
+    "moldovan": "ro",
+    "sinhalese": "si",
+    "castilian": "es",
+    "mandarin": "zh",
+}
+
+def to_language_code(language: str) -> str:
+    """Map a Whisper language name or code, in any case, to the code faster-whisper expects."""
+    language = language.strip().lower()
+    if language in LANGUAGE_CODES.values():
+        return language
+    if language in LANGUAGE_CODES:
+        return LANGUAGE_CODES[language]
+    accepted = ", ".join(name.title() for name in LANGUAGE_CODES)
+    raise ValueError(f"Unsupported language '{language}'. Accepted values are Whisper language codes or one of: {accepted}")
+
+def whisper_language(value: str) -> str:
+    # argparse type: validate the language up front instead of failing after audio extraction
+    try:
+        to_language_code(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+# Languages rendered with the CJK font by the libass renderer
+CJK_LANGUAGE_CODES = {"ja", "zh", "yue", "ko"}
 
 # Logging setup
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# libass lays out SRT subtitles on a 384x288 script canvas which is then scaled to the frame
+ASS_PLAY_RES_Y = 288
+
+def probe_video(video_path: str) -> Dict[str, Any]:
+    result = subprocess.run(
+        [Config.FFPROBE_BINARY, "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "stream=width,height:format=duration", "-of", "json", video_path],
+        check=True, capture_output=True, text=True
+    )
+    info = json.loads(result.stdout)
+    stream = info['streams'][0]
+    return {"width": int(stream['width']), "height": int(stream['height']), "duration": float(info['format']['duration'])}
+
+def escape_filter_path(path: str) -> str:
+    # Escaped once for the filter option parser and once more for the filtergraph parser
+    for special in ("\\':", "\\'[],;"):
+        path = "".join("\\" + char if char in special else char for char in path)
+    return path
+
+@functools.lru_cache(maxsize=None)
+def nvenc_available() -> bool:
+    if not torch.cuda.is_available():
+        return False
+    try:
+        result = subprocess.run([Config.FFMPEG_BINARY, "-hide_banner", "-encoders"], check=True, capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning(f"Could not query ffmpeg encoders: {e}")
+        return False
+    return Config.NVENC_CODEC in result.stdout
+
+def video_encoder_settings() -> Tuple[str, str, List[str]]:
+    """Return (codec, preset, rate-control ffmpeg params) for the output video encoder."""
+    use_nvenc = Config.USE_HW_ENCODER in ('1', 'true', 'yes') or (Config.USE_HW_ENCODER == 'auto' and nvenc_available())
+    if use_nvenc:
+        return Config.NVENC_CODEC, Config.NVENC_PRESET, ['-tune', 'hq', '-rc', 'vbr', '-cq', Config.NVENC_CQ, '-b:v', '0']
+    return Config.VIDEO_CODEC, Config.VIDEO_PRESET, ['-crf', Config.CRF]
+
+@functools.lru_cache(maxsize=4)
+def load_font(font_path: str, font_size: int) -> ImageFont.FreeTypeFont:
+    try:
+        return ImageFont.truetype(font_path, font_size)
+    except IOError:
+        logger.warning(f"Failed to load font from {font_path}. Falling back to default font.")
+        return ImageFont.load_default()
+
+# Scratch surface used only for measuring text
+_METRIC_DRAW = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+
+@functools.lru_cache(maxsize=8192)
+def measure_text(line: str, font_path: str, font_size: int) -> Tuple[int, int, int, int]:
+    return _METRIC_DRAW.textbbox((0, 0), line, font=load_font(font_path, font_size))
+
+def render_subtitle_image(txt: str, video_width: int, font_size: int = Config.DEFAULT_FONT_SIZE, max_lines: int = Config.MAX_SUBTITLE_LINES) -> np.ndarray:
+    """Rasterize a subtitle to a full-width RGBA array."""
+    if not txt.isascii():
+        font_path = Config.JAPANESE_FONT_PATH
+    else:
+        font_path = Config.FONT_PATH
+
+    font = load_font(font_path, font_size)
+    
+    max_char_count = int(video_width / (font_size * 0.6))
+    wrapped_text = textwrap.fill(txt, width=max_char_count)
+    lines = wrapped_text.split('\n')[:max_lines]
+    
+    bboxes = [measure_text(line, font_path, font_size) for line in lines]
+    total_height = sum(bbox[3] for bbox in bboxes)
+    
+    img_width, img_height = video_width, total_height + 20
+    square_outline = Config.SUBTITLE_OUTLINE == 'square'
+    # The square outline is built from the text's alpha mask, so only the mask is drawn here
+    img = Image.new('L', (img_width, img_height), 0) if square_outline else Image.new('RGBA', (img_width, img_height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    
+    y_text = 10
+    for line, bbox in zip(lines, bboxes):
+        x_text = (img_width - bbox[2]) // 2
+        if square_outline:
+            draw.text((x_text, y_text), line, font=font, fill=255)
+        else:
+            draw.text((x_text, y_text), line, font=font, fill=(255, 255, 255, 255), stroke_width=Config.OUTLINE_WIDTH, stroke_fill=(0, 0, 0, 255))
+        y_text += bbox[3]
+    
+    if square_outline:
+        return outline_text_mask(np.array(img), Config.OUTLINE_WIDTH)
+    return np.array(img)
+
+def outline_text_mask(mask: np.ndarray, width: int) -> np.ndarray:
+    """Turn a text alpha mask into white RGBA text with a square black outline of the given width."""
+    height, img_width = mask.shape
+    padded = np.pad(mask, width)
+    # Max over all offsets in the (2w+1)^2 window, the same pixels as drawing the text at every offset
+    outline = mask.copy()
+    for dy in range(2 * width + 1):
+        for dx in range(2 * width + 1):
+            np.maximum(outline, padded[dy:dy + height, dx:dx + img_width], out=outline)
+    
+    # White text composited over the black outline: colour follows the text mask, alpha the dilated mask
+    rgba = np.empty((height, img_width, 4), dtype=np.uint8)
+    rgba[..., :3] = mask[..., None]
+    rgba[..., 3] = outline
+    return rgba
+
+def subtitle_timeline(subs: List[srt.Subtitle]) -> List[Tuple[float, float, Tuple[int, ...]]]:
+    """Split the subtitles into (start, end, indices of visible subtitles) intervals with something on screen."""
+    # Empty and zero- or negative-length cues are never shown (and their end event would sort
+    # before their start, leaving them on screen), so skip them like create_srt does
+    shown = [(i, sub) for i, sub in enumerate(subs) if sub.content.strip() and sub.end > sub.start]
+    # Ends sort before starts at the same timestamp so back-to-back subtitles don't overlap
+    events = sorted(
+        [(sub.start.total_seconds(), 1, i) for i, sub in shown] +
+        [(sub.end.total_seconds(), 0, i) for i, sub in shown]
+    )
+    timeline = []
+    active = set()
+    previous_time = None
+    for time, is_start, i in events:
+        if active and time > previous_time:
+            timeline.append((previous_time, time, tuple(sorted(active))))
+        if is_start:
+            active.add(i)
+        else:
+            active.discard(i)
+        previous_time = time
+    return timeline
+
+# Loaded Whisper models keyed by (model_name, device, compute_type), reused across runs
+_MODEL_CACHE: Dict[Tuple[str, str, str], WhisperModel] = {}
+
 class SubtitleProcessor:
     def __init__(self, video_path: str, srt_path: str):
         self.video_path = video_path
@@ -70,18 +380,20 @@ class SRTTranslator:
         api_key = Config.OPENAI_API_KEY
         if not api_key:
             raise ValueError("OpenAI API key is required. Set it in the environment variable 'OPENAI_API_KEY'.")
-        self.client = OpenAI(api_key=api_key)
+        self.api_key = api_key
         self.model = model
         self.temperature = temperature
+        self.tokenizer = tiktoken.get_encoding(Config.TIKTOKEN_MODEL)
 
     def translate_srt(self, input_srt: str, output_srt: str, source_lang: str, target_lang: str):
         with open(input_srt, 'r', encoding='utf-8') as f:
             subtitle_generator = srt.parse(f.read())
             subtitles = list(subtitle_generator)
 
+        translations = asyncio.run(self.translate_subtitles(subtitles, source_lang, target_lang))
+
         translated_subtitles = []
-        for subtitle in tqdm(subtitles, desc="Translating subtitles"):
-            translated_content = self.translate_text(subtitle.content, source_lang, target_lang)
+        for subtitle, translated_content in zip(subtitles, translations):
             translated_subtitle = srt.Subtitle(
                 index=subtitle.index,
                 start=subtitle.start,
@@ -93,8 +405,86 @@ class SRTTranslator:
         with open(output_srt, 'w', encoding='utf-8') as f:
             f.write(srt.compose(translated_subtitles))
 
-    def translate_text(self, text: str, source_lang: str, target_lang: str) -> str:
-        response = self.client.chat.completions.create(
+    async def translate_subtitles(self, subtitles: List[srt.Subtitle], source_lang: str, target_lang: str) -> List[str]:
+        # The client's connection pool is bound to the running event loop, so each asyncio.run
+        # gets its own client, closed on exit. It retries 429/5xx responses with exponential backoff.
+        async with AsyncOpenAI(api_key=self.api_key, max_retries=Config.OPENAI_MAX_RETRIES) as client:
+            return await self.translate_with_client(client, subtitles, source_lang, target_lang)
+
+    async def translate_with_client(self, client: AsyncOpenAI, subtitles: List[srt.Subtitle], source_lang: str, target_lang: str) -> List[str]:
+        semaphore = asyncio.Semaphore(Config.TRANSLATION_CONCURRENCY)
+
+        async def bounded(texts: List[str]) -> List[str]:
+            async with semaphore:
+                if len(texts) == 1:
+                    return [await self.translate_text(client, texts[0], source_lang, target_lang)]
+                translated = await self.translate_batch(client, texts, source_lang, target_lang)
+
+            # Lines the model dropped or merged are retranslated one by one
+            missing = [i for i in range(1, len(texts) + 1) if i not in translated]
+            if missing:
+                logger.warning(f"Batch response is missing {len(missing)} of {len(texts)} lines, retranslating them individually")
+                fallbacks = await asyncio.gather(*[bounded([texts[i - 1]]) for i in missing])
+                for i, fallback in zip(missing, fallbacks):
+                    translated[i] = fallback[0]
+            return [translated[i] for i in range(1, len(texts) + 1)]
+
+        batches = self.group_subtitles(subtitles)
+        logger.info(f"Translating {len(subtitles)} subtitles in {len(batches)} requests")
+        # gather returns results in task order, so translations line up with subtitles
+        results = await tqdm_asyncio.gather(*[bounded(batch) for batch in batches], desc="Translating subtitles")
+        return [text for batch in results for text in batch]
+
+    def group_subtitles(self, subtitles: List[srt.Subtitle]) -> List[List[str]]:
+        batches = []
+        current_batch = []
+        current_tokens = 0
+
+        texts = [subtitle.content for subtitle in subtitles]
+        token_counts = [len(tokens) for tokens in self.tokenizer.encode_ordinary_batch(texts)]
+
+        for text, text_tokens in zip(texts, token_counts):
+            # Multi-line subtitles can't be represented in a numbered line list, send them alone
+            if '\n' in text:
+                if current_batch:
+                    batches.append(current_batch)
+                    current_batch, current_tokens = [], 0
+                batches.append([text])
+                continue
+
+            if current_batch and (len(current_batch) >= Config.TRANSLATION_BATCH_SIZE or current_tokens + text_tokens > Config.MAX_TOKENS_PER_CHUNK):
+                batches.append(current_batch)
+                current_batch, current_tokens = [], 0
+
+            current_batch.append(text)
+            current_tokens += text_tokens
+
+        if current_batch:
+            batches.append(current_batch)
+
+        return batches
+
+    async def translate_batch(self, client: AsyncOpenAI, texts: List[str], source_lang: str, target_lang: str) -> Dict[int, str]:
+        numbered_text = "\n".join(f"{i}. {text}" for i, text in enumerate(texts, start=1))
+        response = await client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": f"You are a professional translator. Translate each line of the following numbered list of subtitles from {source_lang} to {target_lang}. Maintain the original meaning and nuance as much as possible. Return exactly {len(texts)} lines, each prefixed with its number, e.g. '1. translated text'. Do not merge, split or skip lines."},
+                {"role": "user", "content": numbered_text}
+            ],
+            temperature=self.temperature,
+            max_tokens=Config.GPT_MAX_TOKENS
+        )
+        content = response.choices[0].message.content
+        translated = {}
+        for match in re.finditer(r'^\s*(\d+)\.\s*(.*)$', content, re.MULTILINE):
+            index = int(match.group(1))
+            if 1 <= index <= len(texts) and index not in translated:
+                translated[index] = match.group(2).strip()
+        return translated
+
+    async def translate_text(self, client: AsyncOpenAI, text: str, source_lang: str, target_lang: str) -> str:
+        response = await client.chat.completions.create(
             model=self.model,
             messages=[
                 {"role": "system", "content": f"You are a professional translator. Translate the following text from {source_lang} to {target_lang}. Maintain the original meaning and nuance as much as possible. Do not modify any formatting or line breaks."},
@@ -110,17 +500,14 @@ class SRTGenerator(SubtitleProcessor):
         super().__init__(video_path, output_srt)
         self.model_name = model_name
         self.translate = translate
-        self.tokenizer = tiktoken.get_encoding(Config.TIKTOKEN_MODEL)
         self.language = language
         self.api_key = api_key
 
     def run(self):
         try:
             self.extract_audio()
-            transcription = self.transcribe_audio()
-            chunks = self.split_into_chunks(transcription)
-            results = self.process_chunks(chunks)
-            self.create_srt(results)
+            # Subtitles are written as Whisper yields them instead of after the whole file is decoded
+            self.create_srt(tqdm(self.iter_segments(), desc="Transcribing segments"))
 
             logger.info(f"SRT file has been generated: {self.srt_path}")
         finally:
@@ -128,62 +515,96 @@ class SRTGenerator(SubtitleProcessor):
 
     def extract_audio(self):
         logger.info("Extracting audio from video...")
-        video = VideoFileClip(self.video_path)
-        video.audio.write_audiofile(Config.TEMP_AUDIO_FILE)
+        # Demux straight to the 16 kHz mono PCM Whisper works on, without decoding any video frames
+        subprocess.run(
+            [Config.FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error",
+             "-i", self.video_path, "-vn", "-ac", "1", "-ar", "16000", "-f", "wav", Config.TEMP_AUDIO_FILE],
+            check=True
+        )
         self.temp_files.append(Config.TEMP_AUDIO_FILE)
 
-    def transcribe_audio(self) -> Dict[str, Any]:
+    def iter_segments(self) -> Iterator[Dict[str, Any]]:
         logger.info("Transcribing audio with Whisper...")
         device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"Using device: {device}")
-        logger.info(f"Loading Whisper model: {self.model_name}")
-        model = whisper.load_model(self.model_name).to(device)
-
-        logger.info(f"Performing task: transcribe with language: {self.language}")
-        result = model.transcribe(Config.TEMP_AUDIO_FILE, task="transcribe", language=self.language)
-        return result
-
-    def split_into_chunks(self, transcription: Dict[str, Any]) -> List[Dict[str, Any]]:
-        logger.info("Splitting transcription into chunks...")
-        chunks = []
-        current_chunk = {"text": "", "segments": []}
-        current_tokens = 0
+        compute_type = Config.WHISPER_COMPUTE_TYPE or ("int8_float16" if device == "cuda" else "int8")
+        logger.info(f"Using device: {device} ({compute_type})")
+        model = self.load_model(self.model_name, device, compute_type)
+        pipeline = BatchedInferencePipeline(model=model)
+
+        language = self.language_code
+        batch_size = self.get_batch_size(device)
+        logger.info(f"Performing task: transcribe with language: {language} (batch size: {batch_size})")
+        # VAD splits the audio into speech chunks which are then decoded batch_size at a time
+        segments, info = pipeline.transcribe(
+            Config.TEMP_AUDIO_FILE,
+            task="transcribe",
+            language=language,
+            vad_filter=True,
+            # A dict (not VadOptions) so the pipeline still caps each speech chunk at its 30 s window
+            vad_parameters={"min_silence_duration_ms": Config.VAD_MIN_SILENCE_MS},
+            beam_size=Config.WHISPER_BEAM_SIZE,
+            batch_size=batch_size
+        )
+        logger.info(f"Audio duration: {info.duration:.1f}s")
+        # faster-whisper yields Segment objects lazily; decoding happens while iterating
+        for segment in segments:
+            yield {"start": segment.start, "end": segment.end, "text": segment.text}
 
-        for segment in transcription['segments']:
-            segment_tokens = self.tokenizer.encode(segment['text'])
-            if current_tokens + len(segment_tokens) > Config.MAX_TOKENS_PER_CHUNK:
-                chunks.append(current_chunk)
-                current_chunk = {"text": "", "segments": []}
-                current_tokens = 0
-            
-            current_chunk['text'] += segment['text'] + " "
-            current_chunk['segments'].append(segment)
-            current_tokens += len(segment_tokens)
-
-        if current_chunk['segments']:
-            chunks.append(current_chunk)
-
-        return chunks
-
-    def process_chunks(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        logger.info("Processing chunks...")
-        results = []
-        for chunk in tqdm(chunks, desc="Processing chunks"):
-            results.extend(chunk['segments'])
-        return results
-
-    def create_srt(self, results: List[Dict[str, Any]]):
-        logger.info("Creating SRT file...")
-        subs = []
-        for i, segment in enumerate(results, start=1):
-            start = timedelta(seconds=segment['start'])
-            end = timedelta(seconds=segment['end'])
-            text = segment['text']
-            sub = srt.Subtitle(index=i, start=start, end=end, content=text)
-            subs.append(sub)
-        
-        with open(self.srt_path, 'w', encoding='utf-8') as f:
-            f.write(srt.compose(subs))
+    @property
+    def language_code(self) -> str:
+        return to_language_code(self.language)
+
+    @staticmethod
+    def load_model(model_name: str, device: str, compute_type: str) -> WhisperModel:
+        key = (model_name, device, compute_type)
+        if key not in _MODEL_CACHE:
+            logger.info(f"Loading Whisper model: {model_name}")
+            _MODEL_CACHE[key] = WhisperModel(model_name, device=device, compute_type=compute_type)
+        else:
+            logger.info(f"Reusing loaded Whisper model: {model_name}")
+        return _MODEL_CACHE[key]
+
+    @classmethod
+    def release_model(cls, model_name: Optional[str] = None):
+        """Drop cached Whisper models (all of them if model_name is None) and free their memory."""
+        for key in [k for k in _MODEL_CACHE if model_name is None or k[0] == model_name]:
+            logger.info(f"Releasing Whisper model: {key[0]} ({key[1]}, {key[2]})")
+            del _MODEL_CACHE[key]
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    @staticmethod
+    def get_batch_size(device: str) -> int:
+        if Config.WHISPER_BATCH_SIZE:
+            return int(Config.WHISPER_BATCH_SIZE)
+        if device != "cuda":
+            return 8
+        total_gb = torch.cuda.get_device_properties(0).total_memory / 1024 ** 3
+        if total_gb >= 13:
+            return 32
+        if total_gb >= 10:
+            return 16
+        return 8
+
+    def create_srt(self, segments: Iterable[Dict[str, Any]]):
+        logger.info(f"Writing SRT file: {self.srt_path}")
+        # Stream into a temporary file so a failed transcription never leaves a partial SRT in place
+        temp_srt = self.srt_path + ".tmp"
+        self.temp_files.append(temp_srt)
+        index = 0
+        with open(temp_srt, 'w', encoding='utf-8') as f:
+            for segment in segments:
+                start = timedelta(seconds=segment['start'])
+                end = timedelta(seconds=segment['end'])
+                text = segment['text']
+                # Same entries srt.compose would drop when reindexing
+                if not text.strip() or start >= end:
+                    continue
+                index += 1
+                sub = srt.Subtitle(index=index, start=start, end=end, content=text)
+                f.write(sub.to_srt())
+        os.replace(temp_srt, self.srt_path)
 
 class SubtitleAdder(SubtitleProcessor):
     def __init__(self, video_path: str, output_video: str, input_srt: str, subtitle_height: int = Config.DEFAULT_SUBTITLE_HEIGHT):
@@ -206,82 +627,267 @@ class SubtitleAdder(SubtitleProcessor):
             return list(srt.parse(f.read()))
 
     def add_subtitles_to_video(self, subs: List[srt.Subtitle]):
+        if Config.SUBTITLE_RENDERER == 'pillow':
+            self.composite_subtitles(subs)
+        else:
+            self.burn_subtitles(subs)
+
+    def subtitle_filter(self, srt_path: str, frame_height: int, japanese: bool, font_size: int = Config.DEFAULT_FONT_SIZE) -> str:
+        # force_style sizes are in script units, so convert the pixel sizes used by the Pillow renderer
+        scale = ASS_PLAY_RES_Y / frame_height
+        font_name = Config.JAPANESE_SUBTITLE_FONT_NAME if japanese else Config.SUBTITLE_FONT_NAME
+        style = ",".join([
+            f"FontName={font_name}",
+            "Bold=1",
+            f"Fontsize={font_size * scale:.2f}",
+            "PrimaryColour=&H00FFFFFF",
+            "OutlineColour=&H00000000",
+            "BorderStyle=1",
+            f"Outline={2 * scale:.2f}",
+            "Shadow=0",
+            "Alignment=2",
+            f"MarginV={10 * scale:.2f}",
+        ])
+        return f"pad=iw:ih+{self.subtitle_height}:0:0:black,subtitles={escape_filter_path(srt_path)}:force_style={escape_filter_path(style)}"
+
+    def burn_subtitles(self, subs: List[srt.Subtitle]):
         logger.info(f"Adding subtitles to video with subtitle space height of {self.subtitle_height} pixels...")
-        video = VideoFileClip(self.video_path)
-        
-        original_width, original_height = video.w, video.h
-        new_height = original_height + self.subtitle_height
-        
-        background = ColorClip(size=(original_width, new_height), color=(0,0,0), duration=video.duration)
-        video_clip = video.set_position((0, 0))
-        
-        # Create progress bar for subtitle generation
-        logger.info("Generating subtitle clips...")
-        subtitle_clips = []
-        
-        for sub in tqdm(subs, desc="Creating subtitle clips"):
-            clip = self.create_subtitle_clip(sub.content, original_width) \
-                .set_start(sub.start.total_seconds()) \
-                .set_end(sub.end.total_seconds()) \
-                .set_position((0, original_height))
-            subtitle_clips.append(clip)
-        
-        logger.info("Compositing video with subtitles...")
-        final_video = CompositeVideoClip([background, video_clip] + subtitle_clips, size=(original_width, new_height))
-        final_video = final_video.set_duration(video.duration)
-        
-        logger.info("Rendering final video with subtitles (this may take a while)...")
-        final_video.write_videofile(
-            self.output_video, 
-            codec=Config.VIDEO_CODEC, 
-            audio_codec=Config.AUDIO_CODEC,
-            preset=Config.VIDEO_PRESET,
-            ffmpeg_params=['-crf', Config.CRF, '-pix_fmt', Config.PIXEL_FORMAT],
-            verbose=True,
-            logger="bar"
-        )
+        video_info = probe_video(self.video_path)
+        new_height = video_info['height'] + self.subtitle_height
+        japanese = not all(sub.content.isascii() for sub in subs)
+        codec, preset, encoder_params = video_encoder_settings()
+
+        command = [
+            Config.FFMPEG_BINARY, "-y", "-hide_banner",
+            "-i", self.video_path,
+            "-vf", self.subtitle_filter(self.srt_path, new_height, japanese),
+            "-c:v", codec,
+            "-preset", preset,
+            *encoder_params,
+            "-pix_fmt", Config.PIXEL_FORMAT,
+            "-c:a", "copy",
+            self.output_video
+        ]
+        logger.info(f"Rendering final video with subtitles using {codec} (this may take a while)...")
+        subprocess.run(command, check=True)
+
+        logger.info("Video rendering complete!")
+
+    def composite_subtitles(self, subs: List[srt.Subtitle]):
+        logger.info(f"Adding subtitles to video with subtitle space height of {self.subtitle_height} pixels...")
+        video_info = probe_video(self.video_path)
+        original_width = video_info['width']
+        images = self.render_subtitle_images(subs, original_width)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            concat_list = self.write_subtitle_sequence(temp_dir, subs, images, original_width, video_info['duration'])
+
+            codec, preset, encoder_params = video_encoder_settings()
+            # The subtitle bars are a second video input laid over the black padding in a single encode pass
+            command = [
+                Config.FFMPEG_BINARY, "-y", "-hide_banner",
+                "-i", self.video_path,
+                "-f", "concat", "-safe", "0", "-i", concat_list,
+                "-filter_complex", f"[0:v]pad=iw:ih+{self.subtitle_height}:0:0:black[bg];[bg][1:v]overlay=0:main_h-overlay_h:eof_action=pass[v]",
+                "-map", "[v]", "-map", "0:a?",
+                "-c:v", codec,
+                "-preset", preset,
+                *encoder_params,
+                "-pix_fmt", Config.PIXEL_FORMAT,
+                "-c:a", "copy",
+                self.output_video
+            ]
+            logger.info(f"Rendering final video with subtitles using {codec} (this may take a while)...")
+            subprocess.run(command, check=True)
         
         logger.info("Video rendering complete!")
-    
+
+    def write_subtitle_sequence(self, temp_dir: str, subs: List[srt.Subtitle], images: List[np.ndarray], width: int, duration: float) -> str:
+        # The bar behind the subtitles is always black, so each combination of visible subtitles
+        # is composited once into an opaque PNG and shown for as long as it stays on screen
+        bar_paths = {}
+
+        def bar_path(visible: Tuple[int, ...]) -> str:
+            if visible not in bar_paths:
+                path = os.path.join(temp_dir, f"bar_{len(bar_paths):05d}.png")
+                Image.fromarray(self.composite_bar([images[i] for i in visible], width)).save(path)
+                bar_paths[visible] = path
+            return bar_paths[visible]
+
+        entries = []
+        current_time = 0.0
+        for start, end, visible in subtitle_timeline(subs):
+            if start > current_time:
+                entries.append((bar_path(()), start - current_time))
+            entries.append((bar_path(visible), end - start))
+            current_time = end
+        entries.append((bar_path(()), max(duration - current_time, 0.001)))
+
+        concat_list = os.path.join(temp_dir, "subtitles.ffconcat")
+        with open(concat_list, 'w', encoding='utf-8') as f:
+            f.write("ffconcat version 1.0\n")
+            for path, entry_duration in entries:
+                f.write(f"file '{os.path.basename(path)}'\nduration {entry_duration:.6f}\n")
+            # The concat demuxer ignores the duration of the last entry unless the file is repeated
+            f.write(f"file '{os.path.basename(entries[-1][0])}'\n")
+        logger.info(f"Wrote {len(bar_paths)} subtitle bar images for {len(entries)} timeline entries")
+        return concat_list
+
     @staticmethod
-    def create_subtitle_clip(txt: str, video_width: int, font_size: int = Config.DEFAULT_FONT_SIZE, max_lines: int = Config.MAX_SUBTITLE_LINES) -> ImageClip:
-        if any(ord(char) > 127 for char in txt):
-            font_path = Config.JAPANESE_FONT_PATH
+    def render_subtitle_images(subs: List[srt.Subtitle], video_width: int) -> List[np.ndarray]:
+        # Repeated lines are rendered once, the unique ones in parallel across processes
+        texts = list(dict.fromkeys(sub.content for sub in subs))
+        logger.info(f"Rendering {len(texts)} unique subtitle images for {len(subs)} subtitles with {Config.RENDER_WORKERS} workers...")
+        if Config.RENDER_WORKERS > 1 and len(texts) > 1:
+            chunksize = max(1, len(texts) // (Config.RENDER_WORKERS * 4))
+            with ProcessPoolExecutor(max_workers=Config.RENDER_WORKERS) as executor:
+                rendered = list(tqdm(executor.map(render_subtitle_image, texts, repeat(video_width), chunksize=chunksize), total=len(texts), desc="Rendering subtitle images"))
+        else:
+            rendered = [render_subtitle_image(text, video_width) for text in tqdm(texts, desc="Rendering subtitle images")]
+        images = dict(zip(texts, rendered))
+        reused = len(subs) - len(texts)
+        logger.info(f"Subtitle image reuse: {reused} of {len(subs)} subtitles ({reused / max(len(subs), 1):.0%}) reused an already rendered image")
+        return [images[sub.content] for sub in subs]
+
+    def composite_bar(self, images: List[np.ndarray], width: int) -> np.ndarray:
+        bar = np.zeros((self.subtitle_height, width, 3), dtype=np.float32)
+        for image in images:
+            height = min(image.shape[0], self.subtitle_height)
+            alpha = image[:height, :, 3:4].astype(np.float32) / 255
+            bar[:height] = image[:height, :, :3] * alpha + bar[:height] * (1 - alpha)
+        return bar.round().astype(np.uint8)
+
+class SubtitlePipeline:
+    """Generate an SRT and burn it into the video, overlapping the two steps when two GPUs are available."""
+
+    def __init__(self, video_path: str, output_srt: str, output_video: str, model_name: str, language: str = "japanese", subtitle_height: int = Config.DEFAULT_SUBTITLE_HEIGHT):
+        self.generator = SRTGenerator(video_path, output_srt, model_name, language)
+        self.adder = SubtitleAdder(video_path, output_video, output_srt, subtitle_height)
+
+    def run(self):
+        if torch.cuda.device_count() >= 2 and Config.SUBTITLE_RENDERER != 'pillow':
+            self.run_overlapped()
         else:
-            font_path = Config.FONT_PATH
+            logger.info("Running transcription and subtitle rendering sequentially...")
+            self.generator.run()
+            self.adder.run()
+
+    def run_overlapped(self):
+        logger.info(f"Overlapping transcription with encoding on GPU {Config.PIPELINE_ENCODER_GPU}...")
+        video_path = self.generator.video_path
+        video_info = probe_video(video_path)
+        window = Config.PIPELINE_WINDOW_SECONDS
+        num_windows = max(1, math.ceil(video_info['duration'] / window))
+        japanese = self.generator.language_code in CJK_LANGUAGE_CODES
 
         try:
-            font = ImageFont.truetype(font_path, font_size)
-        except IOError:
-            logger.warning(f"Failed to load font from {font_path}. Falling back to default font.")
-            font = ImageFont.load_default()
-        
-        max_char_count = int(video_width / (font_size * 0.6))
-        wrapped_text = textwrap.fill(txt, width=max_char_count)
-        lines = wrapped_text.split('\n')[:max_lines]
-        
-        dummy_img = Image.new('RGB', (video_width, font_size * len(lines)))
-        dummy_draw = ImageDraw.Draw(dummy_img)
-        max_line_width = max(dummy_draw.textbbox((0, 0), line, font=font)[2] for line in lines)
-        total_height = sum(dummy_draw.textbbox((0, 0), line, font=font)[3] for line in lines)
-        
-        img_width, img_height = video_width, total_height + 20
-        img = Image.new('RGBA', (img_width, img_height), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(img)
-        
-        y_text = 10
-        for line in lines:
-            bbox = draw.textbbox((0, 0), line, font=font)
-            x_text = (img_width - bbox[2]) // 2
-            
-            for adj in range(-2, 3):
-                for adj2 in range(-2, 3):
-                    draw.text((x_text+adj, y_text+adj2), line, font=font, fill=(0, 0, 0, 255))
-            
-            draw.text((x_text, y_text), line, font=font, fill=(255, 255, 255, 255))
-            y_text += bbox[3]
-        
-        return ImageClip(np.array(img))
+            with tempfile.TemporaryDirectory() as temp_dir:
+                # Bounded so transcription never runs more than a window or so ahead of the encoder
+                windows = queue.Queue(maxsize=Config.PIPELINE_QUEUE_WINDOWS)
+                errors = []
+
+                def consume():
+                    while True:
+                        item = windows.get()
+                        if item is None:
+                            return
+                        if errors:
+                            continue
+                        try:
+                            self.encode_window(temp_dir, *item, video_info['height'] + self.adder.subtitle_height, japanese)
+                        except Exception as e:
+                            errors.append(e)
+
+                encoder = threading.Thread(target=consume, daemon=True)
+                encoder.start()
+                try:
+                    self.generator.extract_audio()
+                    segments = []
+                    next_window = 0
+                    for segment in tqdm(self.generator.iter_segments(), desc="Transcribing segments"):
+                        # Stop transcribing as soon as the encoder has failed instead of decoding the rest for nothing
+                        if errors:
+                            raise errors[0]
+                        segments.append(segment)
+                        # Segments arrive in start order, so a window is final once a segment starts after it
+                        while next_window < num_windows and segment['start'] >= (next_window + 1) * window:
+                            windows.put((next_window, self.window_subtitles(segments, next_window)))
+                            next_window += 1
+                    while next_window < num_windows:
+                        if errors:
+                            raise errors[0]
+                        windows.put((next_window, self.window_subtitles(segments, next_window)))
+                        next_window += 1
+                    self.generator.create_srt(segments)
+                    logger.info(f"SRT file has been generated: {self.generator.srt_path}")
+                finally:
+                    windows.put(None)
+                    encoder.join()
+                if errors:
+                    raise errors[0]
+
+                self.concat_windows(temp_dir, num_windows)
+                logger.info(f"Video with subtitles has been generated: {self.adder.output_video}")
+        finally:
+            self.generator.cleanup_temp_files()
+
+    @staticmethod
+    def window_subtitles(segments: List[Dict[str, Any]], index: int) -> List[srt.Subtitle]:
+        # Subtitles overlapping the window, clipped to it and shifted to start at zero
+        window_start = index * Config.PIPELINE_WINDOW_SECONDS
+        window_end = window_start + Config.PIPELINE_WINDOW_SECONDS
+        subs = []
+        for segment in segments:
+            if segment['end'] <= window_start or segment['start'] >= window_end:
+                continue
+            subs.append(srt.Subtitle(
+                index=len(subs) + 1,
+                start=timedelta(seconds=max(segment['start'], window_start) - window_start),
+                end=timedelta(seconds=min(segment['end'], window_end) - window_start),
+                content=segment['text']
+            ))
+        return subs
+
+    def encode_window(self, temp_dir: str, index: int, subs: List[srt.Subtitle], frame_height: int, japanese: bool):
+        window_srt = os.path.join(temp_dir, f"window_{index:05d}.srt")
+        with open(window_srt, 'w', encoding='utf-8') as f:
+            f.write(srt.compose(subs))
+
+        codec, preset, encoder_params = video_encoder_settings()
+        if codec.endswith("_nvenc"):
+            encoder_params = encoder_params + ["-gpu", str(Config.PIPELINE_ENCODER_GPU)]
+        command = [
+            Config.FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error",
+            "-ss", str(index * Config.PIPELINE_WINDOW_SECONDS),
+            "-t", str(Config.PIPELINE_WINDOW_SECONDS),
+            "-i", self.generator.video_path,
+            "-an",
+            "-vf", self.adder.subtitle_filter(window_srt, frame_height, japanese),
+            "-c:v", codec,
+            "-preset", preset,
+            *encoder_params,
+            "-pix_fmt", Config.PIXEL_FORMAT,
+            os.path.join(temp_dir, f"window_{index:05d}.mp4")
+        ]
+        subprocess.run(command, check=True)
+
+    def concat_windows(self, temp_dir: str, num_windows: int):
+        logger.info("Joining encoded windows...")
+        concat_list = os.path.join(temp_dir, "windows.txt")
+        with open(concat_list, 'w', encoding='utf-8') as f:
+            for index in range(num_windows):
+                f.write(f"file 'window_{index:05d}.mp4'\n")
+
+        # Video windows are stream-copied and the original audio track is copied back in
+        command = [
+            Config.FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error",
+            "-f", "concat", "-safe", "0", "-i", concat_list,
+            "-i", self.generator.video_path,
+            "-map", "0:v", "-map", "1:a?",
+            "-c", "copy",
+            self.adder.output_video
+        ]
+        subprocess.run(command, check=True)
 
 def main():
     parser = argparse.ArgumentParser(description="Subtitle Generator and Adder", formatter_class=argparse.RawTextHelpFormatter)
@@ -295,7 +901,7 @@ def main():
     generate_parser = subparsers.add_parser("generate", parents=[common_parser])
     generate_parser.add_argument("--output_srt", required=True, help="Output SRT file path")
     generate_parser.add_argument("--model", default="large-v3", help="Whisper model name (default: large-v3)")
-    generate_parser.add_argument("--language", default="Japanese", help="Language of the audio (default: Japanese)")
+    generate_parser.add_argument("--language", default="Japanese", type=whisper_language, help="Language of the audio, as a Whisper language name or code (default: Japanese)")
     generate_parser.add_argument("--translate", action="store_true", help="Translate the audio to English")
 
     # Add subparser for adding subtitles to a video
@@ -303,6 +909,13 @@ def main():
     add_parser.add_argument("--output_video", required=True, help="Output video file path")
     add_parser.add_argument("--input_srt", required=True, help="Input SRT file path")
 
+    # Pipeline subparser for generating subtitles and adding them to a video in one go
+    pipeline_parser = subparsers.add_parser("pipeline", parents=[common_parser])
+    pipeline_parser.add_argument("--output_srt", required=True, help="Output SRT file path")
+    pipeline_parser.add_argument("--output_video", required=True, help="Output video file path")
+    pipeline_parser.add_argument("--model", default="large-v3", help="Whisper model name (default: large-v3)")
+    pipeline_parser.add_argument("--language", default="Japanese", type=whisper_language, help="Language of the audio, as a Whisper language name or code (default: Japanese)")
+
     # Translate subparser for translating an SRT file
     translate_parser = subparsers.add_parser("translate")
     translate_parser.add_argument("--input_srt", required=True, help="Input SRT file path")
@@ -319,6 +932,9 @@ def main():
     elif args.action == "add":
         adder = SubtitleAdder(args.input, args.output_video, args.input_srt)
         adder.run()
+    elif args.action == "pipeline":
+        pipeline = SubtitlePipeline(args.input, args.output_srt, args.output_video, args.model, args.language)
+        pipeline.run()
     elif args.action == "translate":
         translator = SRTTranslator(temperature=args.temperature)
         translator.translate_srt(args.input_srt, args.output_srt, args.source_lang, args.target_lang)